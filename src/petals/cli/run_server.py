@@ -193,6 +193,14 @@ def main():
         limits.logger.setLevel(logging.WARNING)
         limits.increase_file_limit(file_limit, file_limit)
 
+    block_indices = args.pop("block_indices")
+    if block_indices is not None:
+        try:
+            start_block, end_block = [int(index.strip()) for index in block_indices.split(":")]
+        except Exception as e:
+            raise ValueError(f"Failed to parse `--block_indices {block_indices}`, must be start:end (e.g. 0:18)")
+        args["block_indices"] = range(start_block, end_block)
+
     compression_type = args.pop("compression").upper()
     compression = getattr(CompressionType, compression_type)
 
@@ -43,8 +43,10 @@ _ignored_keys = ContextVar("ignored_keys", default=None)
 
 
 @contextlib.contextmanager
-def ignore_keys(patterns: List[str]):
-    token = _ignored_keys.set(patterns)
+def ignore_keys(patterns: Optional[List[str]]):
+    # Merge all patterns into one regex, so that each parameter name is scanned only once
+    ignored_re = re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+    token = _ignored_keys.set(ignored_re)
     try:
         yield
     finally:
@@ -56,7 +58,8 @@ def patched_get_checkpoint_shard_files(
 ) -> Tuple[List[str], dict]:
     """Same as modeling_utils.get_checkpoint_shard_files(), but does not download shards for the ignored keys."""
 
-    should_ignore_keys = _ignored_keys.get() is not None
+    ignored_re = _ignored_keys.get()
+    should_ignore_keys = ignored_re is not None
     tempdir_ctx = tempfile.TemporaryDirectory() if should_ignore_keys else contextlib.nullcontext()
     with tempdir_ctx as tempdir:
         if should_ignore_keys:
@@ -67,7 +70,7 @@ def patched_get_checkpoint_shard_files(
             index["weight_map"] = {
                 param_name: filename
                 for param_name, filename in index["weight_map"].items()
-                if all(re.search(pattern, param_name) is None for pattern in _ignored_keys.get())
+                if ignored_re.search(param_name) is None
             }
             n_loaded_shards = len(set(index["weight_map"].values()))
             logger.debug(f"Loading {n_loaded_shards} shards out of {n_original_shards}")
@@ -154,8 +154,12 @@ class TransformerBackend(ModuleBackend):
     def _reorder_cache_inplace(self, cache_tensors: torch.Tensor, hypo_ids: torch.Tensor):
         """If hypo_ids is specified, reorder elements of each cache tensor in-place by taking indices from hypo_ids"""
         if not is_dummy(hypo_ids):
+            hypo_ids_by_device = {}  # keys and values on the same device share one copy of hypo_ids
             for cache_tensor in cache_tensors:
-                cache_tensor[...] = cache_tensor[hypo_ids.to(cache_tensor.device)]  # in-place reorder cache by hypo ids
+                device_hypo_ids = hypo_ids_by_device.get(cache_tensor.device)
+                if device_hypo_ids is None:
+                    device_hypo_ids = hypo_ids_by_device[cache_tensor.device] = hypo_ids.to(cache_tensor.device)
+                cache_tensor[...] = cache_tensor[device_hypo_ids]  # in-place reorder cache by hypo ids
 
     def _select_layer_past(self, cache_tensors: Sequence[torch.Tensor], prefix_length: int) -> Sequence[torch.Tensor]:
         """Extract first {prefix_length} tokens and reshape them such that they can be used as layer_past"""
@@ -7,9 +7,10 @@ If necessary, one can rewrite this to implement a different behavior, such as:
 
 """
 import json
+import re
 import time
 from contextlib import suppress
-from typing import Dict, Optional, Union
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Set, Union
 
 import safetensors
 import torch
@@ -28,6 +29,7 @@ from petals.server.block_utils import get_model_block, resolve_block_dtype
 from petals.utils.auto_config import AutoDistributedConfig
 from petals.utils.disk_cache import DEFAULT_CACHE_DIR, allow_cache_reads, allow_cache_writes, free_disk_space_for
 from petals.utils.hf_auth import always_needs_auth
+from petals.utils.misc import prefetch_in_background
 
 logger = get_logger(__name__)
 
@@ -43,69 +45,144 @@ def load_pretrained_block(
     cache_dir: Optional[str] = None,
     max_disk_space: Optional[int] = None,
 ) -> nn.Module:
+    (block,) = load_pretrained_blocks(
+        model_name,
+        [block_index],
+        config=config,
+        torch_dtype=torch_dtype,
+        revision=revision,
+        token=token,
+        cache_dir=cache_dir,
+        max_disk_space=max_disk_space,
+    )
+    return block
+
+
+def load_pretrained_blocks(
+    model_name: str,
+    block_indices: Sequence[int],
+    *,
+    config: Optional[PretrainedConfig] = None,
+    torch_dtype: Union[torch.dtype, str] = "auto",
+    revision: Optional[str] = None,
+    token: Optional[Union[str, bool]] = None,
+    cache_dir: Optional[str] = None,
+    max_disk_space: Optional[int] = None,
+) -> Iterator[nn.Module]:
+    """
+    Load several blocks of the same model and yield them one by one.
+    Unlike calling load_pretrained_block() for each block, this finds and parses the checkpoint index only once.
+    While the caller processes a block, weights of the next one are read from disk in a background thread,
+    so at most two blocks are kept in RAM at a time (provided that the caller drops blocks it has processed).
+    """
     if config is None:
         config = AutoDistributedConfig.from_pretrained(model_name, use_auth_token=token)
     if cache_dir is None:
         cache_dir = DEFAULT_CACHE_DIR
+    if always_needs_auth(model_name) and token is None:
+        token = True
 
     assert torch_dtype in DTYPE_MAP.values(), f"torch_dtype must be one of {list(DTYPE_MAP.values())}"
     torch_dtype = resolve_block_dtype(config, torch_dtype)
 
-    with init_empty_weights():
-        block = get_model_block(config, layer_idx=block_index)
+    block_prefixes = {block_index: f"{config.block_prefix}.{block_index}." for block_index in block_indices}
+    block_filenames = _find_block_files(
+        model_name, block_prefixes.values(), revision=revision, token=token, cache_dir=cache_dir
+    )
 
-    block_prefix = f"{config.block_prefix}.{block_index}."
-    state_dict = _load_state_dict_from_repo(
-        model_name,
-        block_prefix,
-        revision=revision,
-        token=token,
-        cache_dir=cache_dir,
-        max_disk_space=max_disk_space,
+    # Only file reads happen in the background thread. Modules must be created in the caller's thread, since
+    # init_empty_weights() patches nn.Module.register_parameter for the whole process and would otherwise move
+    # parameters created by the caller meanwhile (e.g., quantized or LoRA weights in convert_block) to the meta device
+    state_dicts = prefetch_in_background(
+        _load_state_dict_from_repo(
+            model_name,
+            block_prefixes[block_index],
+            block_filenames[block_prefixes[block_index]],
+            revision=revision,
+            token=token,
+            cache_dir=cache_dir,
+            max_disk_space=max_disk_space,
+        )
+        for block_index in block_indices
     )
+    try:
+        for block_index in block_indices:
+            state_dict = next(state_dicts)  # Not using zip(), since it keeps a reference to the last items it yielded
+            with init_empty_weights():
+                block = get_model_block(config, layer_idx=block_index)
 
-    for param_name, _ in block.named_parameters():
-        assert param_name in state_dict, f"{param_name} not in state dict"
-        param = state_dict[param_name]
-        if not str(param.dtype).startswith(("torch.uint", "torch.int", "torch.bool")):
-            param = param.to(torch_dtype)
-        set_module_tensor_to_device(block, param_name, "cpu", value=param, dtype=param.dtype)
+            for param_name, _ in block.named_parameters():
+                assert param_name in state_dict, f"{param_name} not in state dict"
+                param = state_dict[param_name]
+                if not str(param.dtype).startswith(("torch.uint", "torch.int", "torch.bool")):
+                    param = param.to(torch_dtype)
+                set_module_tensor_to_device(block, param_name, "cpu", value=param, dtype=param.dtype)
+            del state_dict
 
-    logger.info(f"Loaded {model_name} block {block_index}")
-    return block
+            logger.info(f"Loaded {model_name} block {block_index}")
+            yield block
+    finally:
+        state_dicts.close()  # Stop prefetching if the caller does not need more blocks
 
 
 StateDict = Dict[str, torch.Tensor]
 
 
-def _load_state_dict_from_repo(
+def _find_block_files(
     model_name: str,
-    block_prefix: str,
+    block_prefixes: Iterable[str],
     *,
     revision: Optional[str] = None,
     token: Optional[Union[str, bool]] = None,
     cache_dir: str,
-    max_disk_space: Optional[int] = None,
-) -> StateDict:
-    if always_needs_auth(model_name) and token is None:
-        token = True
+) -> Dict[str, Set[str]]:
+    """Find checkpoint files that contain weights of the given blocks, so we never touch shards of other blocks"""
 
+    block_prefixes = list(block_prefixes)
+    if not block_prefixes:
+        return {}
     index_file = _find_index_file(model_name, revision=revision, token=token, cache_dir=cache_dir)
-    if index_file.endswith(".index.json"):  # Sharded model
-        path = get_file_from_repo(model_name, filename=index_file, use_auth_token=token, cache_dir=cache_dir)
-        if path is None:
-            # _find_index_file() told that a file exists but we can't get it (e.g., it just disappeared)
-            raise ValueError(f"Failed to get file {index_file}")
-
-        with open(path) as f:
-            index = json.load(f)
-        filenames = {
-            filename for param_name, filename in index["weight_map"].items() if param_name.startswith(block_prefix)
-        }
+    if not index_file.endswith(".index.json"):  # Non-sharded model
+        return {block_prefix: {index_file} for block_prefix in block_prefixes}
+
+    path = get_file_from_repo(
+        model_name, filename=index_file, revision=revision, use_auth_token=token, cache_dir=cache_dir
+    )
+    if path is None:
+        # _find_index_file() told that a file exists but we can't get it (e.g., it just disappeared)
+        raise ValueError(f"Failed to get file {index_file}")
+
+    with open(path) as f:
+        index = json.load(f)
+
+    # Match all prefixes with one regex, so that the index is scanned only once regardless of the number of blocks.
+    # Since each prefix ends with ".", none of them can be a prefix of another one (e.g., "h.1." and "h.10.")
+    prefix_re = re.compile("|".join(map(re.escape, block_prefixes)))
+    block_filenames = {block_prefix: set() for block_prefix in block_prefixes}
+    for param_name, filename in index["weight_map"].items():
+        match = prefix_re.match(param_name)
+        if match is not None:
+            block_filenames[match.group()].add(filename)
+
+    for block_prefix, filenames in block_filenames.items():
         if not filenames:
             raise RuntimeError(f"Block {block_prefix}* not found in the index: {index['weight_map']}")
-    else:  # Non-sharded model
-        filenames = {index_file}
+    n_loaded_shards = len(set.union(*block_filenames.values()))
+    n_original_shards = len(set(index["weight_map"].values()))
+    logger.debug(f"Loading {n_loaded_shards} shards out of {n_original_shards}")
+    return block_filenames
+
+
+def _load_state_dict_from_repo(
+    model_name: str,
+    block_prefix: str,
+    filenames: Set[str],
+    *,
+    revision: Optional[str] = None,
+    token: Optional[Union[str, bool]] = None,
+    cache_dir: str,
+    max_disk_space: Optional[int] = None,
+) -> StateDict:
     logger.debug(f"Loading {block_prefix}* from {filenames}")
 
     state_dict = {}
@@ -190,6 +267,19 @@ def _load_state_dict_from_repo_file(
     while True:
         try:
             with allow_cache_writes(cache_dir):
+                # Another server on this host may have downloaded the file while we were waiting for the lock,
+                # in this case we reuse it instead of freeing disk space for a second copy
+                path = get_file_from_repo(
+                    model_name,
+                    filename,
+                    revision=revision,
+                    use_auth_token=token,
+                    cache_dir=cache_dir,
+                    local_files_only=True,
+                )
+                if path is not None:
+                    return _load_state_dict_from_local_file(path, block_prefix=block_prefix)
+
                 url = hf_hub_url(model_name, filename, revision=revision)
                 file_size = get_hf_file_metadata(url, token=token).size
                 if file_size is not None:
@@ -215,7 +305,21 @@ def _load_state_dict_from_repo_file(
 
 def _load_state_dict_from_local_file(path: str, *, block_prefix: Optional[str] = None) -> StateDict:
     if path.endswith(".bin"):
-        return torch.load(path, map_location="cpu")
+        try:
+            # Memory-map the file, so that only the parameters of the requested block are actually read from disk
+            state_dict = torch.load(path, map_location="cpu", mmap=True)
+            is_mmapped = True
+        except (TypeError, RuntimeError):
+            # PyTorch < 2.1 and checkpoints saved in the legacy (non-zipfile) format do not support mmap
+            state_dict = torch.load(path, map_location="cpu")
+            is_mmapped = False
+        # Memory-mapped tensors are views of the cached file, so we copy the ones we keep to RAM. Otherwise, the weights
+        # may be re-read from disk during inference, and free_disk_space_for() can't free the file while it is mapped
+        return {
+            key: value.clone() if is_mmapped else value
+            for key, value in state_dict.items()
+            if block_prefix is None or key.startswith(block_prefix)
+        }
 
     if path.endswith(".safetensors"):
         with safetensors.safe_open(path, framework="pt", device="cpu") as f:
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import contextlib
 import gc
 import math
 import multiprocessing as mp
@@ -27,7 +28,7 @@ from petals.data_structures import CHAIN_DELIMITER, UID_DELIMITER, ModelInfo, Se
 from petals.server import block_selection
 from petals.server.backend import TransformerBackend, merge_inference_pools_inplace
 from petals.server.block_utils import get_block_size, resolve_block_dtype
-from petals.server.from_pretrained import load_pretrained_block
+from petals.server.from_pretrained import load_pretrained_blocks
 from petals.server.handler import TransformerConnectionHandler
 from petals.server.memory_cache import MemoryCache
 from petals.server.reachability import ReachabilityProtocol, check_direct_reachability, validate_reachability
@@ -58,7 +59,7 @@ class Server:
         public_name: Optional[str] = None,
         throughput: Union[float, str],
         num_blocks: Optional[int] = None,
-        block_indices: Optional[str] = None,
+        block_indices: Optional[Sequence[int]] = None,
         num_handlers: int = 8,
         inference_max_length: Optional[int] = None,
         min_batch_size: int = 1,
@@ -186,6 +187,13 @@ class Server:
             logger.info(f"Model weights will be split between {', '.join(tensor_parallel_devices)}")
             check_device_balance(self.tensor_parallel_devices)
 
+        for tp_device in self.tensor_parallel_devices:
+            if tp_device.type == "cuda":
+                # Initialize CUDA context and cuBLAS handles in advance, so they don't delay loading the first block
+                dummy = torch.ones(1, 1, device=tp_device)
+                torch.mm(dummy, dummy)
+                torch.cuda.synchronize(tp_device)
+
         if quant_type is None:
             quant_type = QuantType.NF4 if device.type == "cuda" else QuantType.NONE
         self.quant_type = quant_type
@@ -219,11 +227,11 @@ class Server:
         if num_blocks is not None:
             num_blocks = min(num_blocks, self.block_config.num_hidden_layers)
         if block_indices is not None:
-            try:
-                start_block, end_block = [int(index.strip()) for index in block_indices.split(":")]
-            except Exception as e:
-                raise ValueError(f"Failed to parse `--block_indices {block_indices}`, must be start:end (e.g. 0:18)")
-            block_indices = range(start_block, end_block)
+            assert not isinstance(block_indices, str), (
+                f"block_indices must be a sequence of ints (e.g., range(0, 18)), got {block_indices!r}. "
+                f"The start:end string format is only supported by the --block_indices CLI argument"
+            )
+            block_indices = list(block_indices)
             num_blocks = len(block_indices)
         self.strict_block_indices, self.num_blocks = block_indices, num_blocks
 
@@ -482,12 +490,18 @@ class ModuleContainer(threading.Thread):
 
         assert len(tensor_parallel_devices) >= 1 and all(isinstance(d, torch.device) for d in tensor_parallel_devices)
 
+        # All blocks take and return hidden states of the same shape, so they can share the same schema
+        hidden_states_schema = (
+            BatchTensorDescriptor(1, 2048, block_config.hidden_size, dtype=torch_dtype, compression=compression),
+        )
+
         blocks = {}
         try:
-            for module_uid, block_index in zip(module_uids, block_indices):
-                block = load_pretrained_block(
+            # Closing the generator stops prefetching the next block if we fail to convert the current one
+            with contextlib.closing(
+                load_pretrained_blocks(
                     converted_model_name_or_path,
-                    block_index,
+                    block_indices,
                     config=block_config,
                     torch_dtype=torch_dtype,
                     revision=revision,
@@ -495,40 +509,34 @@ class ModuleContainer(threading.Thread):
                     cache_dir=cache_dir,
                     max_disk_space=max_disk_space,
                 )
-                block = convert_block(
-                    block,
-                    block_index,
-                    block_config,
-                    tensor_parallel_devices,
-                    device,
-                    quant_type,
-                    adapters=server_info.adapters,
-                    freeze=True,
-                    token=token,
-                    cache_dir=cache_dir,
-                    max_disk_space=max_disk_space,
-                )
-                blocks[module_uid] = TransformerBackend(
-                    module_uid,
-                    block,
-                    config=block_config,
-                    memory_cache=memory_cache,
-                    backend_dtype=torch_dtype,
-                    max_chunk_size_bytes=max_chunk_size_bytes,
-                    args_schema=(
-                        BatchTensorDescriptor(
-                            1, 2048, block_config.hidden_size, dtype=torch_dtype, compression=compression
-                        ),
-                    ),
-                    kwargs_schema={},
-                    outputs_schema=(
-                        BatchTensorDescriptor(
-                            1, 2048, block_config.hidden_size, dtype=torch_dtype, compression=compression
-                        ),
-                    ),
-                    min_batch_size=min_batch_size,
-                    max_batch_size=max_batch_size,
-                )
+            ) as pretrained_blocks:
+                for module_uid, block_index, block in zip(module_uids, block_indices, pretrained_blocks):
+                    block = convert_block(
+                        block,
+                        block_index,
+                        block_config,
+                        tensor_parallel_devices,
+                        device,
+                        quant_type,
+                        adapters=server_info.adapters,
+                        freeze=True,
+                        token=token,
+                        cache_dir=cache_dir,
+                        max_disk_space=max_disk_space,
+                    )
+                    blocks[module_uid] = TransformerBackend(
+                        module_uid,
+                        block,
+                        config=block_config,
+                        memory_cache=memory_cache,
+                        backend_dtype=torch_dtype,
+                        max_chunk_size_bytes=max_chunk_size_bytes,
+                        args_schema=hidden_states_schema,
+                        kwargs_schema={},
+                        outputs_schema=hidden_states_schema,
+                        min_batch_size=min_batch_size,
+                        max_batch_size=max_batch_size,
+                    )
 
             merge_inference_pools_inplace(blocks)
 
@@ -717,9 +725,12 @@ class ModuleAnnouncerThread(threading.Thread):
     def run(self) -> None:
         while True:
             start_time = time.perf_counter()
+            # announce() may change the state concurrently, so we remember the state we are going to declare.
+            # If it changes to OFFLINE after this line, we'll declare it at the next iteration (trigger is set by then)
+            state = self.server_info.state
 
             self.server_info.cache_tokens_left = self.memory_cache.bytes_left // self.bytes_per_token
-            if self.server_info.state != ServerState.OFFLINE:
+            if state != ServerState.OFFLINE:
                 self._ping_next_servers()
                 self.server_info.next_pings = {
                     peer_id.to_base58(): rtt for peer_id, rtt in self.ping_aggregator.to_dict().items()
@@ -727,21 +738,31 @@ class ModuleAnnouncerThread(threading.Thread):
             else:
                 self.server_info.next_pings = None  # No need to ping if we're disconnecting
 
-            declare_active_modules(
-                self.dht,
-                self.module_uids,
-                self.server_info,
-                expiration_time=get_dht_time() + self.expiration,
-            )
-            if self.server_info.state == ServerState.OFFLINE:
-                break
-            if not self.dht_prefix.startswith("_"):  # Not private
-                self.dht.store(
-                    key="_petals.models",
-                    subkey=self.dht_prefix,
-                    value=self.model_info.to_dict(),
-                    expiration_time=get_dht_time() + self.expiration,
+            # Run both DHT stores concurrently instead of waiting for a separate round trip for each of them
+            expiration_time = get_dht_time() + self.expiration
+            store_futures = [
+                declare_active_modules(
+                    self.dht,
+                    self.module_uids,
+                    self.server_info,
+                    expiration_time=expiration_time,
+                    wait=False,
+                )
+            ]
+            if state != ServerState.OFFLINE and not self.dht_prefix.startswith("_"):  # Not private
+                store_futures.append(
+                    self.dht.store(
+                        key="_petals.models",
+                        subkey=self.dht_prefix,
+                        value=self.model_info.to_dict(),
+                        expiration_time=expiration_time,
+                        return_future=True,
+                    )
                 )
+            for future in store_futures:
+                future.result()
+            if state == ServerState.OFFLINE:
+                break
 
             delay = self.update_period - (time.perf_counter() - start_time)
             if delay < 0:
@@ -70,51 +70,58 @@ def convert_block(
             )
             add_adapter_to_block(block, block_index, adapter_name, adapter_config, adapter_state_dict)
 
+    # Servers never train the blocks, so we disable dropout and other training-only code paths. This is done last,
+    # since the TensorParallel wrapper, quantized layers, and LoRA layers created above start in training mode
+    block.eval()
     return block
 
 
 def quantize_module(model: nn.Module, *, quant_type: QuantType) -> nn.Module:
-    # Import bitsandbytes only when necessary, so Petals runs on platforms not supported by bitsandbytes
-    import bitsandbytes as bnb
-
     for n, module in model.named_children():
-        if len(list(module.children())) > 0:
-            quantize_module(module, quant_type=quant_type)
-
         if isinstance(module, torch.nn.Linear) and n not in ["lm_head", "score"]:
-            assert module.weight.device.type == "cpu", f"expected linear layers on CPU, got {module.weight.device}"
-            if quant_type == QuantType.INT8:
-                model._modules[n] = bnb.nn.Linear8bitLt(
-                    module.in_features,
-                    module.out_features,
-                    module.bias is not None,
-                    has_fp16_weights=False,
-                    threshold=6.0,  # Default from the LLM.int8() paper
-                )
-                model._modules[n].weight = bnb.nn.Int8Params(
-                    module.weight.data, requires_grad=False, has_fp16_weights=False
-                ).to(module.weight.dtype)
-            elif quant_type == QuantType.NF4:
-                compress_statistics = True
-                model._modules[n] = bnb.nn.LinearNF4(
-                    module.in_features,
-                    module.out_features,
-                    module.bias is not None,
-                    compress_statistics=compress_statistics,
-                )
-                model._modules[n].weight = bnb.nn.Params4bit(
-                    module.weight.data,
-                    requires_grad=False,
-                    quant_type="nf4",
-                    blocksize=64,
-                    compress_statistics=compress_statistics,
-                ).to(module.weight.dtype)
-            else:
-                raise ValueError(f"Unsupported quant_type='{quant_type}'")
-            model._modules[n].bias = module.bias
+            model._modules[n] = _quantize_linear(module, quant_type=quant_type)
+        elif next(module.children(), None) is not None:
+            quantize_module(module, quant_type=quant_type)
     return model
 
 
+def _quantize_linear(module: nn.Linear, *, quant_type: QuantType) -> nn.Module:
+    # Import bitsandbytes only when necessary, so Petals runs on platforms not supported by bitsandbytes
+    import bitsandbytes as bnb
+
+    assert module.weight.device.type == "cpu", f"expected linear layers on CPU, got {module.weight.device}"
+    if quant_type == QuantType.INT8:
+        quantized = bnb.nn.Linear8bitLt(
+            module.in_features,
+            module.out_features,
+            module.bias is not None,
+            has_fp16_weights=False,
+            threshold=6.0,  # Default from the LLM.int8() paper
+        )
+        quantized.weight = bnb.nn.Int8Params(module.weight.data, requires_grad=False, has_fp16_weights=False).to(
+            module.weight.dtype
+        )
+    elif quant_type == QuantType.NF4:
+        compress_statistics = True
+        quantized = bnb.nn.LinearNF4(
+            module.in_features,
+            module.out_features,
+            module.bias is not None,
+            compress_statistics=compress_statistics,
+        )
+        quantized.weight = bnb.nn.Params4bit(
+            module.weight.data,
+            requires_grad=False,
+            quant_type="nf4",
+            blocksize=64,
+            compress_statistics=compress_statistics,
+        ).to(module.weight.dtype)
+    else:
+        raise ValueError(f"Unsupported quant_type='{quant_type}'")
+    quantized.bias = module.bias
+    return quantized
+
+
 def make_tensor_parallel(
     block: nn.Module, model_config: PretrainedConfig, devices: Sequence[torch.device], output_device: torch.device
 ) -> nn.Module:
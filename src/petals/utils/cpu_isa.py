@@ -0,0 +1,15 @@
+import functools
+import platform
+
+
+@functools.lru_cache(maxsize=None)
+def has_avx512() -> bool:
+    """Checks if both the CPU and the OS support AVX512, which makes bfloat16 matmuls on CPU fast in PyTorch"""
+
+    if platform.machine() != "x86_64":
+        return False
+
+    # Import of cpufeature may crash on non-x86_64 machines
+    from cpufeature import CPUFeature
+
+    return bool(CPUFeature["AVX512f"] and CPUFeature["OS_AVX512"])
@@ -1,3 +1,7 @@
+import queue
+import threading
+from typing import Iterator, TypeVar
+
 import torch
 
 DUMMY = torch.empty(0)  # dummy tensor that replaces empty prompt or adapter parameters
@@ -27,3 +31,48 @@ def docstring_from(source):
         return dest
 
     return add_docstring
+
+
+T = TypeVar("T")
+
+_END_OF_ITERATOR = object()
+
+
+def prefetch_in_background(iterator: Iterator[T]) -> Iterator[T]:
+    """
+    Iterate over items of :iterator:, computing the next item in a background thread
+    while the caller is processing the current one (useful to overlap disk reads with compute)
+
+    :note: the background thread only runs next(iterator), so the iterator must be safe to advance from another thread
+    :note: if the caller stops early (e.g., due to an exception), the thread finishes the item it is computing and
+      exits without fetching more. The thread is a daemon, so it never prevents the interpreter from exiting
+    :note: no references to the items are kept after they are yielded, so at most two items are alive at a time:
+      the one being processed by the caller and the one being prefetched
+    """
+
+    requests, results = queue.Queue(), queue.Queue()
+
+    def _prefetch_worker():
+        while requests.get():
+            try:
+                # Hand the item over without keeping a local reference, so that it can be freed as soon as
+                # the caller is done with it (the worker may wait for the next request for a long time)
+                results.put((next(iterator, _END_OF_ITERATOR), None))
+            except Exception as e:
+                results.put((None, e))
+                return
+
+    threading.Thread(target=_prefetch_worker, name="prefetch_in_background", daemon=True).start()
+    try:
+        requests.put(True)
+        while True:
+            item, exception = results.get()
+            if exception is not None:
+                raise exception
+            if item is _END_OF_ITERATOR:
+                return
+            requests.put(True)
+            slot, item = [item], None
+            yield slot.pop()  # This generator must not hold the item while it is paused here
+    finally:
+        requests.put(False)
@@ -1,7 +1,7 @@
 import contextlib
 import re
 import time
-from typing import List, Optional, Sequence, Union
+from typing import Dict, List, Optional, Sequence, Union
 
 import bitsandbytes as bnb
 import torch
@@ -209,12 +209,42 @@ def create_lora_adapter(block):
                 setattr(module, child_name, lora_wrapped_child)
 
 
+def _group_lora_weights_by_module(peft_state_dict, block_index: int) -> Dict[str, Dict[str, torch.Tensor]]:
+    """
+    Index LoRA tensors of a block by the path of their layer inside this block,
+    e.g. {"self_attn.q_proj": {"lora_A.weight": ..., "lora_B.weight": ...}, "mlp.experts.0.w1": {...}, ...}
+    """
+    lora_weights_by_module = {}
+    for peft_key, tensor in peft_state_dict.items():
+        module_path, sep, param_suffix = peft_key.rpartition(".lora_")
+        if not sep:
+            continue
+        _, sep, module_path_in_block = module_path.partition(f".{block_index}.")
+        if not sep:
+            continue  # Not a layer of this block
+        lora_weights_by_module.setdefault(module_path_in_block, {})["lora_" + param_suffix] = tensor
+    return lora_weights_by_module
+
+
+def _find_lora_weights(
+    lora_weights_by_module: Dict[str, Dict[str, torch.Tensor]], module_path: str
+) -> Optional[Dict[str, torch.Tensor]]:
+    """Find LoRA tensors of a layer, ignoring outer modules (e.g., "module_shards.0.") that are not in the adapter"""
+    path_components = module_path.split(".")
+    for i in range(len(path_components)):
+        lora_weights = lora_weights_by_module.get(".".join(path_components[i:]))
+        if lora_weights is not None:
+            return lora_weights
+    return None
+
+
 def add_adapter_to_block(block, block_index, adapter_name, peft_config, peft_state_dict):
     assert peft_config["peft_type"] == "LORA", "Petals works only with LORA adapters"
     if peft_config["lora_dropout"] > 0:
         logger.info(f"Adapter {adapter_name} has dropout enabled, this server will disable dropout")
 
-    for _, module in block.named_modules():
+    lora_weights_by_module = _group_lora_weights_by_module(peft_state_dict, block_index)
+    for module_name, module in block.named_modules():
         for child_name, child in module.named_children():
             if not isinstance(child, (lora.Linear, lora.Linear8bitLt, lora.Linear4bit)):
                 continue
@@ -223,40 +253,41 @@ def add_adapter_to_block(block, block_index, adapter_name, peft_config, peft_sta
                 isinstance(peft_config["target_modules"], str)
                 and re.fullmatch(peft_config["target_modules"], child_name)
             ):
-                is_lora_a_loaded = False
-                is_lora_b_loaded = False
-                for peft_key in peft_state_dict:
-                    if child_name not in peft_key:
-                        continue
-
-                    if adapter_name not in child.lora_A:
-                        child.update_layer(
-                            adapter_name,
-                            peft_config["r"],
-                            peft_config["lora_alpha"],
-                            use_rslora=peft_config.get("use_rslora", False),
-                            lora_dropout=peft_config["lora_dropout"],
-                            init_lora_weights=peft_config["init_lora_weights"],
+                child_path = f"{module_name}.{child_name}" if module_name else child_name
+                lora_weights = _find_lora_weights(lora_weights_by_module, child_path)
+                if not lora_weights:
+                    continue
+
+                for param_name in lora_weights:
+                    if param_name.endswith(".bias"):
+                        raise NotImplementedError(
+                            f"LoRA adapters with bias not supported: {block_index}.{child_path}.{param_name}"
                         )
-                        child.train(False)
-                        for p in child.parameters():
-                            p.requires_grad = False
-
-                    if peft_key.endswith(".lora_A.weight"):
-                        child.lora_A[adapter_name].weight[...] = peft_state_dict[peft_key]
-                        is_lora_a_loaded = True
-                    elif peft_key.endswith(".lora_A.bias"):
-                        raise NotImplementedError(f"LoRA adapters with bias not supported: {peft_key}")
-                    elif peft_key.endswith(".lora_B.weight"):
-                        child.lora_B[adapter_name].weight[...] = peft_state_dict[peft_key]
-                        is_lora_b_loaded = True
-                    elif peft_key.endswith(".lora_B.bias"):
-                        raise NotImplementedError(f"LoRA adapters with bias not supported: {peft_key}")
+
+                if adapter_name not in child.lora_A:
+                    child.update_layer(
+                        adapter_name,
+                        peft_config["r"],
+                        peft_config["lora_alpha"],
+                        use_rslora=peft_config.get("use_rslora", False),
+                        lora_dropout=peft_config["lora_dropout"],
+                        init_lora_weights=peft_config["init_lora_weights"],
+                    )
+                    child.train(False)
+                    for p in child.parameters():
+                        p.requires_grad = False
+
+                is_lora_a_loaded = "lora_A.weight" in lora_weights
+                is_lora_b_loaded = "lora_B.weight" in lora_weights
+                if is_lora_a_loaded:
+                    child.lora_A[adapter_name].weight[...] = lora_weights["lora_A.weight"]
+                if is_lora_b_loaded:
+                    child.lora_B[adapter_name].weight[...] = lora_weights["lora_B.weight"]
 
                 if is_lora_a_loaded and is_lora_b_loaded:
-                    logger.debug(f"Loaded adapter {adapter_name} for block {block_index}.{child_name}")
+                    logger.debug(f"Loaded adapter {adapter_name} for block {block_index}.{child_path}")
                 elif is_lora_a_loaded or is_lora_b_loaded:
-                    raise ValueError(f"Invalid adapter {adapter_name} for block {block_index}.{child_name}")
+                    raise ValueError(f"Invalid adapter {adapter_name} for block {block_index}.{child_path}")
     logger.info(f"Loaded adapter {adapter_name} for block {block_index}")
 
 
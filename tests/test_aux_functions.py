@@ -1,14 +1,18 @@
+import json
 import subprocess
 import sys
+import time
+import weakref
 
 import pytest
 import torch
 from hivemind import nested_compare, nested_flatten
 
 from petals import AutoDistributedConfig
+from petals.server import from_pretrained
 from petals.server.throughput import measure_compute_rps
 from petals.utils.convert_block import QuantType
-from petals.utils.misc import DUMMY, is_dummy
+from petals.utils.misc import DUMMY, is_dummy, prefetch_in_background
 from petals.utils.packaging import pack_args_kwargs, unpack_args_kwargs
 from test_utils import MODEL_NAME
 
@@ -73,3 +77,66 @@ def test_pack_inputs():
             assert torch.all(original == restored)
         else:
             assert original == restored
+
+
+def test_prefetch_in_background():
+    assert list(prefetch_in_background(iter(range(10)))) == list(range(10))
+    assert list(prefetch_in_background(iter([]))) == []
+
+    def failing_iterator():
+        yield 1
+        raise ValueError("expected error")
+
+    items = prefetch_in_background(failing_iterator())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="expected error"):
+        next(items)
+
+    num_fetched = 0
+
+    def counting_iterator():
+        nonlocal num_fetched
+        for i in range(100):
+            num_fetched += 1
+            yield i
+
+    items = prefetch_in_background(counting_iterator())
+    assert next(items) == 0
+    items.close()
+    time.sleep(0.1)
+    assert num_fetched <= 2, "prefetching should run at most one item ahead and stop once the caller is done"
+
+    class Payload:
+        pass
+
+    items = prefetch_in_background(Payload() for _ in range(3))
+    first_item = weakref.ref(next(items))
+    second_item = weakref.ref(next(items))
+    time.sleep(0.1)
+    assert first_item() is None and second_item() is None, "prefetching should not keep items after yielding them"
+    assert len(list(items)) == 1
+
+
+def test_find_block_files(tmp_path, monkeypatch):
+    weight_map = {
+        "h.1.self_attention.weight": "model-00001.safetensors",
+        "h.1.mlp.weight": "model-00002.safetensors",  # Block 1 is split across two shards
+        "h.10.self_attention.weight": "model-00003.safetensors",
+        "h.10.mlp.weight": "model-00003.safetensors",
+        "word_embeddings.weight": "model-00000.safetensors",
+    }
+    index_path = tmp_path / "model.safetensors.index.json"
+    index_path.write_text(json.dumps({"weight_map": weight_map}))
+    monkeypatch.setattr(from_pretrained, "_find_index_file", lambda *args, **kwargs: index_path.name)
+    monkeypatch.setattr(from_pretrained, "get_file_from_repo", lambda *args, **kwargs: str(index_path))
+
+    block_files = from_pretrained._find_block_files("test/model", ["h.1.", "h.10."], cache_dir=str(tmp_path))
+    assert block_files == {
+        "h.1.": {"model-00001.safetensors", "model-00002.safetensors"},
+        "h.10.": {"model-00003.safetensors"},
+    }
+
+    assert from_pretrained._find_block_files("test/model", [], cache_dir=str(tmp_path)) == {}
+
+    with pytest.raises(RuntimeError):
+        from_pretrained._find_block_files("test/model", ["h.1.", "h.2."], cache_dir=str(tmp_path))
@@ -2,9 +2,17 @@ import os
 import shutil
 
 import pytest
+import torch
+import torch.nn as nn
 from huggingface_hub import snapshot_download
 
-from petals.utils.peft import check_peft_repository, load_peft
+from petals.utils.peft import (
+    _group_lora_weights_by_module,
+    add_adapter_to_block,
+    check_peft_repository,
+    create_lora_adapter,
+    load_peft,
+)
 
 UNSAFE_PEFT_REPO = "artek0chumak/bloom-560m-unsafe-peft"
 SAFE_PEFT_REPO = "artek0chumak/bloom-560m-safe-peft"
@@ -64,3 +72,76 @@ def test_load_layer_nonexists(tmpdir):
         block_idx=1337,
         cache_dir=tmpdir,
     )
+
+
+def _make_block_with_similar_layer_names() -> nn.Module:
+    block = nn.Module()
+    block.self_attention = nn.Module()
+    block.self_attention.dense = nn.Linear(8, 8)
+    block.mlp = nn.Module()
+    block.mlp.dense_h_to_4h = nn.Linear(8, 32)
+    block.mlp.dense_4h_to_h = nn.Linear(32, 8)
+    block.experts = nn.ModuleList([nn.Module(), nn.Module()])  # Same-named layers under different parents
+    for expert in block.experts:
+        expert.w1 = nn.Linear(8, 8)
+    return block
+
+
+def _make_lora_state_dict(block: nn.Module, rank: int, prefix: str = "base_model.model.transformer.h.0."):
+    peft_state_dict = {}
+    for name, module in block.named_modules():
+        if isinstance(module, nn.Linear):
+            peft_state_dict[f"{prefix}{name}.lora_A.weight"] = torch.randn(rank, module.in_features)
+            peft_state_dict[f"{prefix}{name}.lora_B.weight"] = torch.randn(module.out_features, rank)
+    return peft_state_dict
+
+
+def test_group_lora_weights_by_module():
+    peft_state_dict = _make_lora_state_dict(_make_block_with_similar_layer_names(), rank=2)
+    peft_state_dict["base_model.model.transformer.h.1.mlp.dense_h_to_4h.lora_A.weight"] = torch.randn(2, 8)
+    lora_weights_by_module = _group_lora_weights_by_module(peft_state_dict, block_index=0)
+
+    assert set(lora_weights_by_module) == {
+        "self_attention.dense",
+        "mlp.dense_h_to_4h",
+        "mlp.dense_4h_to_h",
+        "experts.0.w1",
+        "experts.1.w1",
+    }
+    for module_path, lora_weights in lora_weights_by_module.items():
+        assert set(lora_weights) == {"lora_A.weight", "lora_B.weight"}
+        for param_name, tensor in lora_weights.items():
+            assert tensor is peft_state_dict[f"base_model.model.transformer.h.0.{module_path}.{param_name}"]
+
+
+def test_add_adapter_to_block():
+    rank = 2
+    peft_config = dict(
+        peft_type="LORA",
+        r=rank,
+        lora_alpha=4,
+        lora_dropout=0.0,
+        init_lora_weights=True,
+        target_modules=["dense", "dense_h_to_4h", "w1"],
+    )
+    block = _make_block_with_similar_layer_names()
+    peft_state_dict = _make_lora_state_dict(block, rank=rank)
+    peft_state_dict["base_model.model.transformer.h.0.mlp.dense_4h_to_h.lora_B.bias"] = torch.randn(8)
+    create_lora_adapter(block)
+
+    # Layers of the server-side block are nested into outer modules, like shards of a TensorParallel block
+    wrapped_block = nn.Module()
+    wrapped_block.module_shards = nn.ModuleList([block])
+
+    # dense_4h_to_h is not a target module, so its (unsupported) bias is ignored
+    add_adapter_to_block(wrapped_block, 0, "test_adapter", peft_config, peft_state_dict)
+    for name in ["self_attention.dense", "mlp.dense_h_to_4h", "experts.0.w1", "experts.1.w1"]:
+        layer = block.get_submodule(name)
+        prefix = f"base_model.model.transformer.h.0.{name}"
+        assert torch.equal(layer.lora_A["test_adapter"].weight, peft_state_dict[f"{prefix}.lora_A.weight"])
+        assert torch.equal(layer.lora_B["test_adapter"].weight, peft_state_dict[f"{prefix}.lora_B.weight"])
+    assert "test_adapter" not in block.mlp.dense_4h_to_h.lora_A
+
+    peft_config["target_modules"] = ["dense", "dense_h_to_4h", "dense_4h_to_h"]
+    with pytest.raises(NotImplementedError):
+        add_adapter_to_block(wrapped_block, 0, "adapter_with_bias", peft_config, peft_state_dict)